@@ -9,15 +9,23 @@ bind = f"0.0.0.0:{os.environ.get('PORT', '4900')}"
 backlog = 2048
 
 # Worker processes
-workers = min(multiprocessing.cpu_count() * 2 + 1, 8)
-worker_class = 'sync'
+# Requests mostly wait on git and Bitbucket, so use threaded workers: one
+# process per core, each overlapping many blocking calls. Request handlers
+# must stay thread-safe (no process-wide state such as the working directory).
+workers = multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = 16
 worker_connections = 1000
 timeout = 120
-keepalive = 2
+# Let in-flight git pushes finish on reload (must exceed timeout)
+graceful_timeout = 130
+# Threaded workers can hold idle connections, so let the frontend proxy reuse them
+keepalive = 30
 
-# Restart workers after this many requests, to help prevent memory leaks
-max_requests = 1000
-max_requests_jitter = 100
+# Restart workers after this many requests, to help prevent memory leaks;
+# kept high so workers hold on to their warmed DNS/TLS state
+max_requests = 5000
+max_requests_jitter = 500
 
 # Load application code before the worker processes are forked
 preload_app = True
@@ -37,8 +45,21 @@ pidfile = '/tmp/gunicorn.pid'
 user = None
 group = None
 tmp_upload_dir = None
+# Worker heartbeat files on tmpfs, so a busy disk cannot stall them
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
 
 # Security
 limit_request_line = 4094
 limit_request_fields = 100
-limit_request_field_size = 8190
\ No newline at end of file
+limit_request_field_size = 8190
+
+# Server hooks
+def post_fork(server, worker):
+    """Warm DNS and a pooled Bitbucket connection in each new worker"""
+    from app import warm_up_bitbucket
+    warm_up_bitbucket()
+
+def worker_exit(server, worker):
+    """Flush the application's queued log records before the worker exits"""
+    from app import stop_log_listener
+    stop_log_listener()
\ No newline at end of file
@@ -1,14 +1,43 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 import subprocess
 import tempfile
 import os
 import shutil
-import base64
-import urllib.parse
+import re
+import fcntl
+import hashlib
+import socket
+import http.cookiejar
+import threading
+import atexit
+import queue
 import logging
-from logging.handlers import RotatingFileHandler
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from cachetools import TTLCache
+from tenacity import retry, retry_if_exception_type, retry_if_result, stop_after_attempt, stop_after_delay, wait_exponential
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, used by jsonify and request.get_json"""
+    
+    def dumps(self, obj, **kwargs):
+        # Dates go through Flask's default() (HTTP date format) and non-str keys are
+        # accepted, as with the default provider
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Production Configuration
 class Config:
@@ -19,44 +48,442 @@ class Config:
     BITBUCKET_URL = "git-bitbucket.aws.fico.com:8443"
     PROJECT_KEY = "SRE-PLATFORM"
     REPO_SLUG = "fico-pto-tenant"
+    # How /whitelist/add writes: 'rest' (Bitbucket file edit API) or 'git' (mirror worktree commit/push)
+    WRITE_BACKEND = os.environ.get('WHITELIST_WRITE_BACKEND', 'rest')
+    # Persistent bare mirror the git backend fetches into and adds worktrees from
+    GIT_REPO_URL = f"https://{BITBUCKET_URL}/scm/sre-platform/fico-pto-tenant.git"
+    GIT_MIRROR_DIR = os.environ.get('WHITELIST_MIRROR_DIR', '/var/lib/whitelist-api/mirror.git')
+    # Per-request worktrees live on tmpfs (RAM) when available, so checkouts never hit disk
+    GIT_WORKTREE_DIR = os.environ.get('WHITELIST_WORKTREE_DIR') or ('/dev/shm/whitelist' if os.path.isdir('/dev/shm') else None)
 
 app.config.from_object(Config)
 
+# Request threads only enqueue log records; a listener thread formats and
+# writes them to the file handler
+_log_queue_handler = None
+_log_file_handler = None
+_log_listener = None
+
+def start_log_listener():
+    """Start the background thread that writes queued log records"""
+    global _log_listener
+    if _log_queue_handler is None:
+        return
+    
+    # A fresh queue per process: after a fork the inherited one may hold the
+    # parent's records or a lock taken by the parent's listener thread
+    _log_queue_handler.queue = queue.Queue(-1)
+    _log_listener = QueueListener(_log_queue_handler.queue, _log_file_handler, respect_handler_level=True)
+    _log_listener.start()
+
+def stop_log_listener():
+    """Flush queued log records and stop the listener thread"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
 # Configure logging for production
 if not app.debug and not app.testing:
     if not os.path.exists('logs'):
         os.mkdir('logs')
     
-    file_handler = RotatingFileHandler('logs/flask_app.log', maxBytes=10240000, backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
+    _log_file_handler = RotatingFileHandler('logs/flask_app.log', maxBytes=10240000, backupCount=10)
+    _log_file_handler.setFormatter(logging.Formatter(
         '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
     ))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    _log_file_handler.setLevel(logging.INFO)
+    _log_queue_handler = QueueHandler(queue.Queue(-1))
+    app.logger.addHandler(_log_queue_handler)
     app.logger.setLevel(logging.INFO)
+    
+    start_log_listener()
+    # Threads do not survive fork, so each (preloaded) gunicorn worker starts its own
+    os.register_at_fork(after_in_child=start_log_listener)
+    atexit.register(stop_log_listener)
     app.logger.info('Flask API startup')
 
-def validate_input(entry, environment, tenant_name):
+# Shared Bitbucket HTTP session, pools TCP/TLS connections across requests
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0))
+_session.verify = False
+# The session is shared by every caller, so Bitbucket's session cookies must not be
+# kept: each request authenticates with its own Basic credentials only
+_session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+# git resolved once at import (before gunicorn forks) instead of a $PATH search per spawn
+GIT_BIN = shutil.which('git') or 'git'
+
+# GIT_ASKPASS program answering git's prompts with the per-request credentials
+# from the environment; written next to the mirror at startup
+GIT_ASKPASS_SCRIPT = '''#!/bin/sh
+case "$1" in
+    Username*) printf '%s\\n' "$GIT_USERNAME" ;;
+    *) printf '%s\\n' "$GIT_PASSWORD" ;;
+esac
+'''
+
+# The git backend publishes with one shell script so add/commit/push is a single
+# phase; values travel through the environment to avoid quoting
+GIT_PUBLISH_SCRIPT = (
+    '"$GIT_BIN" add . && '
+    '"$GIT_BIN" commit --quiet -m "$COMMIT_MESSAGE" && '
+    '"$GIT_BIN" push --quiet --no-progress origin "HEAD:refs/heads/$BRANCH_NAME"'
+)
+
+# git stderr fragments that indicate a transient network failure
+GIT_TRANSIENT_ERRORS = (
+    'could not resolve host',
+    'connection timed out',
+    'connection reset by peer',
+    'the remote end hung up unexpectedly'
+)
+
+# Input validation rules
+ENTRY_MAX_LENGTH = 500
+ALLOWED_ENV_NAMES = ('ort', 'int', 'prod', 'dev', 'staging', 'test')
+ALLOWED_ENVS = frozenset(ALLOWED_ENV_NAMES)
+ALLOWED_ENVS_MESSAGE = f"Environment must be one of: {', '.join(ALLOWED_ENV_NAMES)}"
+TENANT_NAME_RE = re.compile(r'[_-]*[A-Za-z0-9][A-Za-z0-9_-]*')
+# A single path component that cannot start with a dot, so no '..', '.git' or absolute paths
+FILE_NAME_RE = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9._-]*')
+FILE_NAME_MESSAGE = "File name can only contain letters, numbers, dots, hyphens, and underscores, and cannot start with a dot"
+
+def validate_input(entry, environment, tenant_name, file_name=None):
     """Validate input parameters"""
     errors = []
     
     # Validate entry
-    if not entry or len(entry.strip()) == 0:
+    if not (entry.strip() if entry else ''):
         errors.append("Entry cannot be empty")
-    elif len(entry) > 500:
-        errors.append("Entry too long (max 500 characters)")
+    elif len(entry) > ENTRY_MAX_LENGTH:
+        errors.append(f"Entry too long (max {ENTRY_MAX_LENGTH} characters)")
+    elif '\n' in entry or '\r' in entry:
+        errors.append("Entry must be a single line")
     
     # Validate environment
-    allowed_envs = ['ort', 'int', 'prod', 'dev', 'staging', 'test']
-    if environment and environment.lower() not in allowed_envs:
-        errors.append(f"Environment must be one of: {', '.join(allowed_envs)}")
+    if environment and environment.lower() not in ALLOWED_ENVS:
+        errors.append(ALLOWED_ENVS_MESSAGE)
     
     # Validate tenant name
-    if tenant_name and not tenant_name.replace('-', '').replace('_', '').isalnum():
+    if tenant_name and not TENANT_NAME_RE.fullmatch(tenant_name):
         errors.append("Tenant name can only contain letters, numbers, hyphens, and underscores")
     
+    # Validate file name
+    if file_name is not None and not FILE_NAME_RE.fullmatch(file_name):
+        errors.append(FILE_NAME_MESSAGE)
+    
     return errors
 
+def _bitbucket_api_url(path):
+    """Build a Bitbucket REST API URL for the configured repository"""
+    return (f"https://{app.config['BITBUCKET_URL']}/rest/api/1.0/projects/"
+            f"{app.config['PROJECT_KEY']}/repos/{app.config['REPO_SLUG']}/{path}")
+
+# Transient failures are retried with exponential backoff, bounded so a flaky
+# Bitbucket cannot hold a request (or the git mirror lock) for long.
+# Only idempotent operations go through these helpers.
+@retry(
+    stop=stop_after_attempt(4) | stop_after_delay(120),
+    wait=wait_exponential(multiplier=0.5, max=5),
+    retry=retry_if_exception_type((requests.ConnectionError, requests.Timeout)),
+    reraise=True
+)
+def _bitbucket_get(url, **kwargs):
+    """GET a Bitbucket REST API URL, retrying connection errors and timeouts"""
+    return _session.get(url, timeout=(3, 30), **kwargs)
+
+def _is_transient_git_failure(result):
+    """Whether a failed git command looks like a network blip worth retrying"""
+    stderr = result.stderr.lower()
+    return result.returncode != 0 and any(marker in stderr for marker in GIT_TRANSIENT_ERRORS)
+
+@retry(
+    stop=stop_after_attempt(4) | stop_after_delay(120),
+    wait=wait_exponential(multiplier=0.5, max=5),
+    retry=retry_if_exception_type(subprocess.TimeoutExpired) | retry_if_result(_is_transient_git_failure),
+    retry_error_callback=lambda retry_state: retry_state.outcome.result()
+)
+def _run_git(args, **kwargs):
+    """Run a git command, retrying timeouts and transient network failures"""
+    # Only stderr is kept, for error reporting; stdout is never read
+    return subprocess.run(
+        [GIT_BIN, *args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=60, **kwargs
+    )
+
+def warm_up_bitbucket():
+    """Resolve Bitbucket and open a pooled connection so the first request skips DNS and TLS setup"""
+    host, _, port = app.config['BITBUCKET_URL'].partition(':')
+    try:
+        socket.getaddrinfo(host, int(port or 443))
+        _session.head(f"https://{app.config['BITBUCKET_URL']}/status", timeout=2)
+    except (OSError, requests.RequestException) as e:
+        app.logger.warning(f"Bitbucket warm-up failed: {e}")
+
+def _credentials_digest(username, password):
+    """Digest identifying a set of credentials in cache keys without storing them"""
+    return hashlib.blake2b(f"{username}:{password}".encode('utf-8'), digest_size=16).hexdigest()
+
+# Pre-flight branch lookups keyed by (branch, credentials digest) so bad
+# requests are rejected without touching git or the edit API
+_branch_status_cache = TTLCache(maxsize=512, ttl=60)
+_branch_status_lock = threading.Lock()
+
+# Last whitelist contents served by /whitelist/view with their validators,
+# keyed by (branch, file path, credentials digest), for conditional GETs
+_view_cache = TTLCache(maxsize=1024, ttl=30)
+_view_cache_lock = threading.Lock()
+
+def _branch_status(branch_name, username, password):
+    """Return 200 if the branch exists, 404 if it does not, otherwise Bitbucket's status code"""
+    cache_key = (branch_name, _credentials_digest(username, password))
+    
+    with _branch_status_lock:
+        status = _branch_status_cache.get(cache_key)
+    if status is not None:
+        return status
+    
+    # filterText is a substring match, so walk every page before calling the branch missing
+    params = {"filterText": branch_name, "limit": 100}
+    while True:
+        response = _bitbucket_get(_bitbucket_api_url("branches"), auth=(username, password), params=params)
+        if response.status_code != 200:
+            status = response.status_code
+            break
+        page = response.json()
+        if any(b.get("displayId") == branch_name for b in page.get("values") or []):
+            status = 200
+            break
+        if page.get("isLastPage", True):
+            status = 404
+            break
+        if page.get("nextPageStart") is None:
+            # A partial listing with no way to continue proves nothing, so it is never cached
+            status = 502
+            break
+        params["start"] = page["nextPageStart"]
+    
+    # Only definitive answers are cached, transient upstream errors are retried
+    if status in (200, 401, 403, 404):
+        with _branch_status_lock:
+            _branch_status_cache[cache_key] = status
+    return status
+
+def _read_whitelist_file(auth, branch_name, file_path):
+    """Read a file at the tip of a branch - returns (source_commit_id, content or None if missing, error_response)"""
+    # The latest commit touching the file is the edit's sourceCommitId; reading the
+    # content at that commit (not the branch) keeps the pair consistent
+    commits_response = _bitbucket_get(
+        _bitbucket_api_url("commits"),
+        auth=auth,
+        params={"path": file_path, "until": branch_name, "limit": 1}
+    )
+    
+    if commits_response.status_code != 200:
+        app.logger.error(f"Reading commits of '{branch_name}' failed: {commits_response.status_code}")
+        return None, None, (jsonify({
+            "error": f"Failed to read branch '{branch_name}'",
+            "suggestion": f"Make sure branch '{branch_name}' exists in the repository",
+            "status_code": commits_response.status_code
+        }), commits_response.status_code)
+    
+    latest_commits = commits_response.json().get("values") or []
+    if not latest_commits:
+        return None, None, None
+    
+    source_commit_id = latest_commits[0]["id"]
+    raw_response = _bitbucket_get(
+        _bitbucket_api_url(f"raw/{file_path}"),
+        auth=auth,
+        params={"at": source_commit_id}
+    )
+    
+    if raw_response.status_code == 200:
+        return source_commit_id, raw_response.text, None
+    if raw_response.status_code == 404:
+        # File was deleted by its latest commit
+        return None, None, None
+    
+    app.logger.error(f"Reading {file_path} failed: {raw_response.status_code}")
+    return None, None, (jsonify({
+        "error": "File not found or access denied",
+        "file_path": file_path,
+        "branch": branch_name,
+        "status_code": raw_response.status_code
+    }), raw_response.status_code)
+
+def _commit_entry_via_rest(auth, branch_name, file_path, source_commit_id, content, entry, commit_message):
+    """Append an entry with the Bitbucket file edit API - returns an error response or None"""
+    if content and not content.endswith('\n'):
+        content += '\n'
+    
+    form = {
+        "branch": (None, branch_name),
+        "message": (None, commit_message),
+        "content": (None, f"{content}{entry}\n")
+    }
+    if source_commit_id:
+        form["sourceCommitId"] = (None, source_commit_id)
+    
+    put_response = _session.put(
+        _bitbucket_api_url(f"browse/{file_path}"),
+        auth=auth,
+        files=form,
+        timeout=(3, 30)
+    )
+    
+    if put_response.status_code == 409:
+        app.logger.error(f"Commit to '{branch_name}' rejected, {file_path} changed concurrently")
+        return jsonify({
+            "error": f"{file_path} was modified concurrently on branch '{branch_name}'",
+            "suggestion": "Retry the request"
+        }), 409
+    if put_response.status_code != 200:
+        app.logger.error(f"Commit to '{branch_name}' failed: {put_response.status_code} {put_response.text}")
+        return jsonify({
+            "error": f"Failed to commit to branch '{branch_name}'",
+            "status_code": put_response.status_code
+        }), 500
+    
+    return None
+
+def _init_git_mirror():
+    """Create the bare mirror used by the git write backend"""
+    mirror_dir = app.config['GIT_MIRROR_DIR']
+    os.makedirs(mirror_dir, exist_ok=True)
+    
+    askpass_path = os.path.join(mirror_dir, 'whitelist-askpass')
+    with open(askpass_path, 'w') as f:
+        f.write(GIT_ASKPASS_SCRIPT)
+    os.chmod(askpass_path, 0o700)
+    
+    if app.config['GIT_WORKTREE_DIR']:
+        os.makedirs(app.config['GIT_WORKTREE_DIR'], exist_ok=True)
+    
+    if os.path.exists(os.path.join(mirror_dir, 'HEAD')):
+        return
+    
+    # Credentials only arrive with requests, so the mirror starts empty and the
+    # first fetch of each branch populates it
+    subprocess.run([GIT_BIN, "init", "--bare", "--quiet", mirror_dir], check=True)
+    subprocess.run([GIT_BIN, "-C", mirror_dir, "remote", "add", "origin", app.config['GIT_REPO_URL']], check=True)
+    app.logger.info(f"Initialized git mirror at {mirror_dir}")
+
+def _commit_entry_via_git(username, password, branch_name, folder_name, file_path, header, entry, commit_message):
+    """Append an entry through a mirror worktree commit/push - returns an error response or None"""
+    mirror_dir = app.config['GIT_MIRROR_DIR']
+    
+    # Credentials reach git only through the child environment: never the remote
+    # URL, argv or logged stderr. Configured credential helpers are disabled so
+    # they cannot answer first or store the password.
+    git_env = {
+        **os.environ,
+        "GIT_ASKPASS": os.path.join(mirror_dir, 'whitelist-askpass'),
+        "GIT_USERNAME": username,
+        "GIT_PASSWORD": password,
+        "GIT_TERMINAL_PROMPT": "0",
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": "credential.helper",
+        "GIT_CONFIG_VALUE_0": "",
+        "BRANCH_NAME": branch_name,
+        "GIT_BIN": GIT_BIN
+    }
+    
+    # One writer at a time per mirror, across workers and threads
+    with open(os.path.join(mirror_dir, 'whitelist-api.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        
+        # Create temporary directory for the worktree
+        temp_dir = tempfile.mkdtemp(prefix='whitelist_', dir=app.config['GIT_WORKTREE_DIR'])
+        
+        try:
+            # Bring the branch up to date, only new commits and trees are transferred;
+            # blobs are fetched lazily for the files the sparse checkout needs
+            app.logger.info(f"Fetching branch '{branch_name}' for user '{username}'")
+            
+            fetch_result = _run_git([
+                "-C", mirror_dir, "fetch", "--quiet", "--no-progress", "--prune", "--no-tags", "--filter=blob:none",
+                "origin", f"+refs/heads/{branch_name}:refs/heads/{branch_name}"
+            ], env=git_env)
+            
+            if fetch_result.returncode != 0:
+                app.logger.error(f"Git fetch failed: {fetch_result.stderr}")
+                return jsonify({
+                    "error": f"Failed to fetch branch '{branch_name}'",
+                    "suggestion": f"Make sure branch '{branch_name}' exists in the repository"
+                }), 500
+            
+            # Check out only the tenant folder (and top-level files); each step runs
+            # as its own git call so a failure names the step that broke
+            checkout_steps = (
+                ("worktree add", ["-C", mirror_dir, "worktree", "add", "--quiet", "--no-checkout", "--detach", temp_dir, branch_name]),
+                ("sparse-checkout", ["-C", temp_dir, "sparse-checkout", "set", "--cone", folder_name]),
+                ("checkout", ["-C", temp_dir, "checkout", "--quiet"])
+            )
+            for step, args in checkout_steps:
+                step_result = _run_git(args, env=git_env)
+                if step_result.returncode != 0:
+                    app.logger.error(f"Git {step} failed: {step_result.stderr}")
+                    return jsonify({
+                        "error": f"Failed to check out branch '{branch_name}'"
+                    }), 500
+            
+            # Create folder structure if it doesn't exist
+            if not os.path.exists(os.path.join(temp_dir, folder_name)):
+                app.logger.info(f"Creating folder structure: {folder_name}")
+                os.makedirs(os.path.join(temp_dir, folder_name), exist_ok=True)
+            
+            # Add the new entry to the file, creating it with the header if needed;
+            # one open call covers both cases
+            fd = os.open(os.path.join(temp_dir, file_path), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            with os.fdopen(fd, 'a') as f:
+                if os.fstat(fd).st_size == 0:
+                    f.write(header)
+                f.write(f"{entry}\n")
+            
+            # Add, commit, and push changes
+            publish_result = subprocess.run(
+                ["sh", "-c", GIT_PUBLISH_SCRIPT],
+                cwd=temp_dir,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=120,
+                env={
+                    **git_env,
+                    "GIT_AUTHOR_NAME": username,
+                    "GIT_AUTHOR_EMAIL": f"{username}@fico.com",
+                    "GIT_COMMITTER_NAME": username,
+                    "GIT_COMMITTER_EMAIL": f"{username}@fico.com",
+                    "COMMIT_MESSAGE": commit_message
+                }
+            )
+            
+            if publish_result.returncode != 0:
+                app.logger.error(f"Git commit/push failed: {publish_result.stderr}")
+                return jsonify({
+                    "error": f"Failed to commit and push to branch '{branch_name}': {publish_result.stderr}"
+                }), 500
+            
+            return None
+            
+        finally:
+            # Drop the worktree, the mirror keeps the objects for the next fetch
+            try:
+                subprocess.run([
+                    GIT_BIN, "-C", mirror_dir, "worktree", "remove", "--force", temp_dir
+                ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                if os.path.exists(temp_dir):
+                    shutil.rmtree(temp_dir)
+                    subprocess.run(
+                        [GIT_BIN, "-C", mirror_dir, "worktree", "prune"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                    )
+            except Exception as cleanup_error:
+                app.logger.error(f"Cleanup failed: {cleanup_error}")
+
+if app.config['WRITE_BACKEND'] == 'git':
+    _init_git_mirror()
+
 @app.route('/whitelist/add', methods=['POST'])
 def add_whitelist_entry():
     try:
@@ -99,7 +526,7 @@ def add_whitelist_entry():
             }), 400
         
         # Validate inputs
-        validation_errors = validate_input(entry, environment, tenant_name)
+        validation_errors = validate_input(entry, environment, tenant_name, file_name)
         if validation_errors:
             return jsonify({
                 "error": "Validation failed",
@@ -111,119 +538,79 @@ def add_whitelist_entry():
         folder_name = tenant_name
         
         # Get credentials from Authorization header
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Basic '):
+        auth = request.authorization
+        if not auth or auth.type != 'basic' or not auth.username or not auth.password:
             return jsonify({"error": "Basic Authorization required"}), 401
+        username, password = auth.username, auth.password
         
-        # Decode credentials
-        try:
-            encoded_creds = auth_header.split(' ')[1]
-            creds = base64.b64decode(encoded_creds).decode('utf-8')
-            username, password = creds.split(':', 1)
-        except (IndexError, ValueError) as e:
-            return jsonify({"error": "Invalid authorization header format"}), 401
-        
-        # URL encode credentials to handle special characters
-        encoded_username = urllib.parse.quote(username, safe='')
-        encoded_password = urllib.parse.quote(password, safe='')
+        # Reject unknown branches and bad credentials before any write work
+        branch_status = _branch_status(branch_name, username, password)
+        if branch_status == 404:
+            return jsonify({
+                "error": f"Branch '{branch_name}' not found",
+                "suggestion": f"Make sure branch '{branch_name}' exists in the repository"
+            }), 404
+        if branch_status != 200:
+            return jsonify({
+                "error": f"Failed to verify branch '{branch_name}'",
+                "status_code": branch_status
+            }), branch_status
         
-        # Repository URL with URL-encoded credentials
-        repo_url = f"https://{encoded_username}:{encoded_password}@{app.config['BITBUCKET_URL']}/scm/sre-platform/fico-pto-tenant.git"
+        file_path = file_name
+        header = f"# Whitelist for {tenant_name} in {environment}\n# Format: IP,Description,Status\n"
+        commit_message = f"Add {tenant_name} whitelist entry in {environment}: {entry}"
         
-        # Create temporary directory
-        temp_dir = tempfile.mkdtemp(prefix='whitelist_')
+        # Read the current file once: an entry that is already present needs no
+        # commit, and the REST backend edits exactly this revision
+        source_commit_id, content, error_response = _read_whitelist_file(
+            (username, password), branch_name, file_path
+        )
+        if error_response:
+            return error_response
         
-        try:
-            # Clone the constructed branch
-            app.logger.info(f"Cloning branch '{branch_name}' for user '{username}'")
-            
-            clone_result = subprocess.run([
-                "git", "clone", "-b", branch_name, "--depth", "1", repo_url, temp_dir
-            ], capture_output=True, text=True, timeout=120)
-            
-            if clone_result.returncode != 0:
-                app.logger.error(f"Git clone failed: {clone_result.stderr}")
-                return jsonify({
-                    "error": f"Failed to clone branch '{branch_name}'",
-                    "suggestion": f"Make sure branch '{branch_name}' exists in the repository"
-                }), 500
-            
-            # Change to repository directory
-            os.chdir(temp_dir)
-            
-            # Create folder structure if it doesn't exist
-            if not os.path.exists(folder_name):
-                app.logger.info(f"Creating folder structure: {folder_name}")
-                os.makedirs(folder_name, exist_ok=True)
-            
-            # Construct full file path
-            file_path = file_name
-            
-            # Check if file exists, create if not
-            if not os.path.exists(file_path):
-                with open(file_path, 'w') as f:
-                    f.write(f"# Whitelist for {tenant_name} in {environment}\n")
-                    f.write("# Format: IP,Description,Status\n")
-            
-            # Add the new entry to the file
-            app.logger.info(f"Adding entry '{entry}' to {file_path} for tenant {tenant_name}")
-            
-            with open(file_path, "a") as f:
-                f.write(f"{entry}\n")
-            
-            # Configure git user
-            subprocess.run(["git", "config", "user.name", username], check=True)
-            subprocess.run(["git", "config", "user.email", f"{username}@fico.com"], check=True)
-            
-            # Add, commit, and push changes
-            subprocess.run(["git", "add", "."], check=True)
-            
-            commit_message = f"Add {tenant_name} whitelist entry in {environment}: {entry}"
-            
-            commit_result = subprocess.run([
-                "git", "commit", "-m", commit_message
-            ], capture_output=True, text=True)
-            
-            if commit_result.returncode != 0:
-                app.logger.error(f"Git commit failed: {commit_result.stderr}")
-                return jsonify({
-                    "error": f"Failed to commit: {commit_result.stderr}"
-                }), 500
-            
-            push_result = subprocess.run([
-                "git", "push", "origin", branch_name
-            ], capture_output=True, text=True, timeout=120)
-            
-            if push_result.returncode != 0:
-                app.logger.error(f"Git push failed: {push_result.stderr}")
-                return jsonify({
-                    "error": f"Failed to push to branch '{branch_name}': {push_result.stderr}"
-                }), 500
-            
-            app.logger.info(f"Successfully added entry for {tenant_name} in {environment}")
-            
+        if content is not None and f"\n{entry}\n" in f"\n{content}\n":
+            app.logger.info(f"Entry '{entry}' already present in {file_path} on branch '{branch_name}'")
             return jsonify({
-                "status": "success",
-                "message": f"Entry added successfully to {file_path} in {environment} environment",
+                "status": "noop",
+                "message": "Entry already present",
                 "entry": entry,
                 "environment": environment,
                 "branch": branch_name,
                 "tenant": tenant_name,
                 "folder": folder_name,
                 "file": file_name,
-                "file_path": file_path,
-                "commit_message": commit_message
+                "file_path": file_path
             }), 200
-            
-        finally:
-            # Clean up temporary directory
-            try:
-                os.chdir("/")
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-            except Exception as cleanup_error:
-                app.logger.error(f"Cleanup failed: {cleanup_error}")
-                
+        
+        app.logger.info(f"Adding entry '{entry}' to {file_path} on branch '{branch_name}' for user '{username}'")
+        
+        if app.config['WRITE_BACKEND'] == 'git':
+            error_response = _commit_entry_via_git(
+                username, password, branch_name, folder_name, file_path, header, entry, commit_message
+            )
+        else:
+            error_response = _commit_entry_via_rest(
+                (username, password), branch_name, file_path, source_commit_id,
+                header if content is None else content, entry, commit_message
+            )
+        if error_response:
+            return error_response
+        
+        app.logger.info(f"Successfully added entry for {tenant_name} in {environment}")
+        
+        return jsonify({
+            "status": "success",
+            "message": f"Entry added successfully to {file_path} in {environment} environment",
+            "entry": entry,
+            "environment": environment,
+            "branch": branch_name,
+            "tenant": tenant_name,
+            "folder": folder_name,
+            "file": file_name,
+            "file_path": file_path,
+            "commit_message": commit_message
+        }), 200
+        
     except Exception as e:
         app.logger.error(f"Unexpected error in add_whitelist_entry: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
@@ -243,11 +630,16 @@ def view_whitelist():
             tenant_name = request.args.get('tenant') or data.get('tenant')
             file_name = request.args.get('file') or data.get('file', 'Whitelist.csv')
         
+        # Callers that only need the raw content can skip the per-line list with ?lines=0
+        include_lines = request.args.get('lines', '1').lower() not in ('0', 'false', 'no')
+        
         if not environment or not tenant_name:
             return jsonify({
                 "error": "Environment and tenant are required",
                 "usage": "Use ?environment=ort&tenant=FICO-PTO-TENANT or include in JSON body"
             }), 400
+        if not FILE_NAME_RE.fullmatch(file_name):
+            return jsonify({"error": FILE_NAME_MESSAGE}), 400
         
         # Construct paths
         branch_name = f"jenkins-store-{environment.lower()}"
@@ -255,39 +647,41 @@ def view_whitelist():
         file_path = f"{folder_name}/{file_name}"
         
         # Get credentials
-        auth_header = request.headers.get('Authorization')
-        if not auth_header:
-            return jsonify({"error": "Authorization required"}), 401
-        
-        try:
-            encoded_creds = auth_header.split(' ')[1]
-            creds = base64.b64decode(encoded_creds).decode('utf-8')
-            username, password = creds.split(':', 1)
-        except (IndexError, ValueError):
-            return jsonify({"error": "Invalid authorization header"}), 401
+        auth = request.authorization
+        if not auth or auth.type != 'basic' or not auth.username or not auth.password:
+            return jsonify({"error": "Basic Authorization required"}), 401
+        username, password = auth.username, auth.password
         
         # Use Bitbucket REST API to get file content
-        import requests
-        
-        api_url = f"https://{app.config['BITBUCKET_URL']}/rest/api/1.0/projects/{app.config['PROJECT_KEY']}/repos/{app.config['REPO_SLUG']}/raw/{file_path}"
+        api_url = _bitbucket_api_url(f"raw/{file_path}")
         params = {"at": branch_name}
         
-        response = requests.get(api_url, auth=(username, password), params=params, verify=False, timeout=30)
+        # Revalidate a previously served copy instead of downloading it again
+        cache_key = (branch_name, file_path, _credentials_digest(username, password))
+        with _view_cache_lock:
+            cached = _view_cache.get(cache_key)
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
         
-        if response.status_code == 200:
-            lines = response.text.strip().split('\n') if response.text.strip() else []
-            return jsonify({
-                "status": "success",
-                "content": response.text,
-                "lines": lines,
-                "line_count": len(lines),
-                "environment": environment,
-                "branch": branch_name,
-                "tenant": tenant_name,
-                "folder": folder_name,
-                "file": file_name,
-                "file_path": file_path
-            }), 200
+        response = _bitbucket_get(api_url, auth=(username, password), params=params, headers=headers)
+        
+        if response.status_code == 304 and cached:
+            etag, _, content = cached
+            # Re-insert so the TTL restarts while Bitbucket keeps confirming the copy
+            with _view_cache_lock:
+                _view_cache[cache_key] = cached
+        elif response.status_code == 200:
+            content = response.text
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                with _view_cache_lock:
+                    _view_cache[cache_key] = (etag, last_modified, content)
         else:
             return jsonify({
                 "error": "File not found or access denied",
@@ -295,7 +689,31 @@ def view_whitelist():
                 "branch": branch_name,
                 "status_code": response.status_code
             }), response.status_code
-            
+        
+        # Strip the body once
+        stripped = content.strip()
+        result = {
+            "status": "success",
+            "content": content,
+            "line_count": stripped.count('\n') + 1 if stripped else 0,
+            "environment": environment,
+            "branch": branch_name,
+            "tenant": tenant_name,
+            "folder": folder_name,
+            "file": file_name,
+            "file_path": file_path
+        }
+        if include_lines:
+            result["lines"] = stripped.split('\n') if stripped else []
+        
+        view_response = jsonify(result)
+        if etag:
+            # The upstream ETag validates the raw file only; the JSON also varies with the
+            # echoed parameters and ?lines, so clients get a weak tag derived from all of them
+            variant = f"{etag}|{environment}|{tenant_name}|{file_name}|{int(include_lines)}"
+            view_response.headers['ETag'] = f'W/"{hashlib.blake2b(variant.encode("utf-8"), digest_size=16).hexdigest()}"'
+        return view_response, 200
+        
     except Exception as e:
         app.logger.error(f"Error in view_whitelist: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500